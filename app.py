@@ -7,10 +7,16 @@ import streamlit as st
 import altair as alt
 
 # ================= Secrets/ENV =================
-# 将 service account 写入本地，供 gspread 使用
-if "service_account" in st.secrets:
+# 将 service account 写入本地，供 gspread 使用（每个进程只写一次，不随每次交互重写）
+@st.cache_resource(show_spinner=False)
+def _write_service_account() -> bool:
+    if "service_account" not in st.secrets:
+        return False
     with open("service_account.json", "w") as f:
         json.dump(dict(st.secrets["service_account"]), f)
+    return True
+
+_write_service_account()
 
 # 读取 Sheet URL（secrets 优先生效）
 sheet_url = st.secrets.get("INVENTORY_SHEET_URL", None) or os.getenv("INVENTORY_SHEET_URL", None)
@@ -19,22 +25,26 @@ if sheet_url:
 
 # ================ Backend ======================
 # 读写 Google Sheet
-from gsheet import append_records_bulk
+from gsheet import append_values_bulk, SHEET_COLS, read_catalog
 try:
     from gsheet import (
         read_records_cached as read_records_fn,
-        read_catalog_cached as read_catalog_fn,
         bust_cache,
     )
 except Exception:
-    from gsheet import read_records as read_records_fn, read_catalog as read_catalog_fn
+    from gsheet import read_records as read_records_fn
     def bust_cache(): pass
 
+# 主数据（库存产品）很少改动：缓存 5 分钟，刷新按钮会立即清掉
+@st.cache_data(ttl=300, show_spinner=False)
+def read_catalog_fn() -> pd.DataFrame:
+    return read_catalog()
+
 # 统计计算/列名规范化
 try:
-    from compute import compute_stats, _recent_usage_14d_robust as _recent_usage_14d_new, normalize_columns as normalize_columns_compute
+    from compute import compute_stats, normalize_columns as normalize_columns_compute
 except Exception:
-    from compute import compute_stats, _recent_usage_14d_new
+    from compute import compute_stats
     def normalize_columns_compute(df: pd.DataFrame) -> pd.DataFrame:
         return df
 
@@ -48,30 +58,12 @@ ALLOWED_CATS = [
 DEFAULT_CAT = "食物类Food"
 
 # ============== 仅用于录入页的轻量工具 ==============
-def safe_sort(df: pd.DataFrame, by: str, ascending=True):
-    if df is None or df.empty or by not in df.columns:
-        return df
-    return df.sort_values(by, ascending=ascending)
-
-def normalize_cat(x: str) -> str:
-    """把各种写法统一成 4 个固定的中英类别值。"""
-    if x is None:
-        return DEFAULT_CAT
-    s = str(x).strip()
-    if s == "" or s.lower() in ("nan", "none"):
-        return DEFAULT_CAT
-
-    # 兼容旧数据：只写中文的情况
-    if s.startswith("食物类"):
-        return "食物类Food"
-    if s.startswith("清洁类"):
-        return "清洁类Cleaning"
-    if s.startswith("消耗品"):
-        return "消耗品Consumables"
-    if s.startswith("饮品类"):
-        return "饮品类Beverage"
-
-    return s if s in ALLOWED_CATS else DEFAULT_CAT
+def normalize_cat_col(s: pd.Series) -> pd.Series:
+    """把一列分类的各种写法统一成 4 个固定的中英类别：按中文前缀归类，其余（含空值）归默认类；返回 category 列。"""
+    t = s.astype(object).where(s.notna(), "").astype(str).str.strip()
+    prefixes = [c[:3] for c in ALLOWED_CATS]  # 食物类 / 清洁类 / 消耗品 / 饮品类
+    out = np.select([t.str.startswith(p).to_numpy() for p in prefixes], ALLOWED_CATS, default=DEFAULT_CAT)
+    return pd.Series(pd.Categorical(out, categories=ALLOWED_CATS), index=s.index)
 
 def _blank_if_none(x):
     try:
@@ -105,71 +97,151 @@ def build_item_order_from_catalog() -> dict:
             seen.add(name)
     return order
 
-# ---------- 把数量解析成表格要写的形态 ----------
-def to_qty_cell(raw, unit_in: str):
+# ---------- 把数量解析成表格要写的形态（整列） ----------
+def _text_col(s: pd.Series) -> pd.Series:
+    """None/NaN -> 空串，其余转字符串并去首尾空白。"""
+    return s.fillna("").astype(str).str.strip()
+
+def _pct_text(v: float) -> str:
+    """50.0 -> '50%'，12.5 -> '12.5%'；尽量去掉多余小数。"""
+    return f"{int(v)}%" if float(v).is_integer() else f"{v}%"
+
+def to_qty_cells(raw: pd.Series, unit_in: pd.Series) -> pd.DataFrame:
     """
-    返回: (qty_cell, unit_out, is_pct)
-    - 若数量里带 '%' 或 单位是百分号 -> is_pct=True，qty_cell 是 '50%' 这样的字符串；
-    - 其他情况 -> is_pct=False，qty_cell 是数字(float 或 NaN)；
-    - unit_out: 当单位不是 % 时按用户填写返回；若单位写成 %/percent/百分比/ratio，则返回空串。
+    按列解析「数量 + 单位」，返回同索引的 DataFrame：
+    - qty_cell: 数量里带 '%' 或 单位是百分号 -> '50%' 这样的字符串（解析失败为空串）；其他情况为数字(float 或 NaN)；
+    - unit_out: 当单位不是 % 时按用户填写返回；若单位写成 %/percent/百分比/ratio，则返回空串；
+    - is_pct:   是否按百分比处理；
+    - num:      数量的数值（百分比行是百分数本身，如 '50%' -> 50）。
     """
-    s = "" if raw is None else str(raw).strip()
-    unit_norm = (unit_in or "").replace("％", "%").strip()
-
-    # 数量里带百分号
-    if s.endswith("%"):
-        num = pd.to_numeric(s[:-1], errors="coerce")
-        if pd.isna(num):
-            return "", ("" if unit_norm == "%" else unit_norm), True
-        # 写回去就是 '50%' 这种；尽量去掉多余小数
-        numf = float(num)
-        qty_txt = f"{int(numf)}%" if numf.is_integer() else f"{numf}%"
-        return qty_txt, ("" if unit_norm == "%" else unit_norm), True
-
-    # 单位是百分号
-    if unit_norm in {"%", "percent", "百分比", "ratio"}:
-        num = pd.to_numeric(s, errors="coerce")
-        if pd.isna(num):
-            return "", "", True
-        numf = float(num)
-        qty_txt = f"{int(numf)}%" if numf.is_integer() else f"{numf}%"
-        return qty_txt, "", True
-
-    # 普通数量
-    return pd.to_numeric(s, errors="coerce"), unit_norm, False
-
-def _pct_ratio(qty_cell):
-    """'50%' -> 0.5；否则返回 NaN。仅用于金额计算等数值场景。"""
-    if isinstance(qty_cell, str) and qty_cell.strip().endswith("%"):
-        try:
-            return float(qty_cell.strip()[:-1]) / 100.0
-        except Exception:
-            return np.nan
-    return np.nan
+    s = _text_col(raw)
+    unit_norm = _text_col(unit_in).str.replace("％", "%", regex=False).str.strip()
+
+    pct_in_qty = s.str.endswith("%")                                   # 数量里带百分号
+    unit_is_pct = unit_norm.isin(["%", "percent", "百分比", "ratio"])  # 单位是百分号
+    is_pct = pct_in_qty | unit_is_pct
 
-# ---------- 展示：表格居中 + 两位小数 ----------
-def render_centered_table(df: pd.DataFrame):
-    # 找出所有数值列
+    num = pd.to_numeric(s.where(~pct_in_qty, s.str[:-1]), errors="coerce")
+
+    # 百分比行写回 '50%' 这种字符串；只格式化百分比行
+    qty_cell = num.astype(object)
+    qty_cell[is_pct] = ""
+    pct_ok = is_pct & num.notna()
+    qty_cell[pct_ok] = num[pct_ok].map(_pct_text)
+
+    # 数量带 % 时只清掉单位 '%'；仅单位是百分号时单位一律置空
+    unit_out = unit_norm.mask(unit_norm.eq("%") | (~pct_in_qty & unit_is_pct), "")
+
+    return pd.DataFrame({"qty_cell": qty_cell, "unit_out": unit_out, "is_pct": is_pct, "num": num})
+
+def _blank_na(s: pd.Series) -> pd.Series:
+    """NaN -> 空串（写表 / 预览用），其余保持原值。"""
+    return s.astype(object).where(s.notna(), "")
+
+# ---------- 展示：数值列两位小数 ----------
+def render_table_2dp(df: pd.DataFrame):
+    # 数值列交给前端按两位小数显示（column_config），不再生成 Styler 的整表 HTML/CSS
     num_cols = df.select_dtypes(include=[np.number]).columns.tolist()
-    # 为数值列统一设置两位小数
-    fmt_map = {c: "{:.2f}" for c in num_cols}
-
-    styler = (
-        df.style
-          .format(fmt_map)  # 两位小数
-          .set_properties(**{"text-align": "center"})  # 单元格居中
-          .set_table_styles([
-              {"selector": "th", "props": [("text-align", "center")]},        # 表头居中
-              {"selector": "th.col_heading", "props": [("text-align", "center")]},
-              {"selector": "th.row_heading", "props": [("text-align", "center")]},
-          ])
+    col_cfg = {c: st.column_config.NumberColumn(c, format="%.2f") for c in num_cols}
+    st.dataframe(df, column_config=col_cfg, use_container_width=True)
+
+# ---------- 统计：与筛选无关的部分按数据指纹缓存 ----------
+def _df_fingerprint(d: pd.DataFrame):
+    """DataFrame 内容指纹（列名 + 逐行哈希），数据不变时缓存直接命中。"""
+    return (tuple(map(str, d.columns)), pd.util.hash_pandas_object(d, index=True).values.tobytes())
+
+# 只有最新指纹会再次命中：限制条目数，旧数据的结果不会在长时间运行的进程里一直留着
+@st.cache_data(show_spinner=False, max_entries=4, hash_funcs={pd.DataFrame: _df_fingerprint})
+def load_normalized(df_raw: pd.DataFrame) -> pd.DataFrame:
+    """
+    明细统一列名（compute 的规范化），并兜底“分类”列为 4 个固定类别。
+    按原始明细的内容指纹缓存：录入页与统计页共用这一份规范化结果。
+    """
+    df = normalize_columns_compute(df_raw)
+    if "分类 (Category)" not in df.columns:
+        df["分类 (Category)"] = DEFAULT_CAT
+    else:
+        df["分类 (Category)"] = normalize_cat_col(df["分类 (Category)"])
+    return df
+
+def _latest_per_item(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    每个物品最近一条非空的 分类 / 单位（按物品名索引）：一次稳定排序 + 一次 groupby.last（跳过空值）。
+    没有日期列时按表内原顺序取最后一条，不依赖统计流水线。
+    """
+    if df.empty or "食材名称 (Item Name)" not in df.columns:
+        return pd.DataFrame(columns=["分类 (Category)", "单位 (Unit)"])
+    latest_cols = [c for c in ("分类 (Category)", "单位 (Unit)") if c in df.columns]
+    if "日期 (Date)" in df.columns:
+        df = df.sort_values("日期 (Date)", kind="mergesort")
+    return df.groupby("食材名称 (Item Name)")[latest_cols].last()
+
+@st.cache_data(show_spinner=False, max_entries=4, hash_funcs={pd.DataFrame: _df_fingerprint})
+def prepare_stats(df: pd.DataFrame):
+    """
+    统计页中与交互无关的整条流水线（输入为 load_normalized 的结果），按内容指纹缓存：
+      compute_stats -> 附上“类型”列（该物品最近一次的分类）-> 物品行索引
+    返回 ({类型: 统计表}（"全部" 为整表）, {物品名: 行位置数组})。
+    分类筛选 / 预警 / 物品详情都只读这些结果，数据不变时切换控件不再重跑 pandas 计算。
+    """
+    stats_all = compute_stats(df)
+
+    if not df.empty and "食材名称 (Item Name)" in df.columns:
+        stats_all["类型"] = stats_all["食材名称 (Item Name)"].map(_latest_per_item(df)["分类 (Category)"])
+        # 物品详情按位置直接取子表，不再每次整表比较
+        item_index = df.groupby("食材名称 (Item Name)", sort=False).indices
+    else:
+        stats_all["类型"] = DEFAULT_CAT
+        item_index = {}
+    stats_all["类型"] = normalize_cat_col(stats_all["类型"])
+
+    # 类型只有几个固定值：预先按类型分好，切换筛选时直接按键取，不再整表比较
+    stats_by_cat = {"全部": stats_all}
+    stats_by_cat.update({c: g for c, g in stats_all.groupby("类型", sort=False, observed=True)})
+    return stats_by_cat, item_index
+
+# ---------- 库存预警：整列向量化判断 ----------
+PCT_UNITS = ["%", "％", "百分比", "percent", "ratio"]
+
+def stock_alerts(stats: pd.DataFrame) -> np.ndarray:
+    """
+    预警规则（各列只做一次数值转换，不再逐行 apply）：
+      - 饮品类：单位 箱/box 且当前库存 < 2，或 瓶/袋/bottle/bag 且 < 6 -> 报警；未触发则走通用规则
+      - 百分比物料（名称含“糖浆”、单位是百分比、或单位为空且最近剩余在 0~1.5）：最近剩余数量 < 20% 报警
+      - 非百分比：预计还能用天数 < 3 天 报警
+    """
+    name = stats["食材名称 (Item Name)"].astype(str)
+    unit = stats["单位 (Unit)"].astype(str).str.strip()
+    unit_lc = unit.str.lower()
+    cur = pd.to_numeric(stats["当前库存"], errors="coerce")
+    last_rem = pd.to_numeric(stats["最近剩余数量"], errors="coerce")
+    days = pd.to_numeric(stats["预计还能用天数"], errors="coerce")
+
+    # 饮品类优先规则
+    is_bev = stats["类型"].astype(str).str.strip().eq("饮品类Beverage")
+    bev_alert = is_bev & (
+        (unit_lc.isin(["箱", "box"]) & (cur < 2)) |
+        (unit_lc.isin(["瓶", "袋", "bottle", "bag"]) & (cur < 6))
     )
 
-    # 优先用交互表；如果版本不支持样式，就降级为静态表
-    try:
-        st.dataframe(styler, use_container_width=True)
-    except Exception:
-        st.table(styler)
+    # 百分比物料：统计表里多数百分比行单位是空串；允许统计溢出到 150%（1.5）
+    is_pct = (
+        name.str.contains("糖浆", regex=False)
+        | unit.isin(PCT_UNITS)
+        | (unit.eq("") & last_rem.between(0.0, 1.5))
+    )
+
+    alert = bev_alert | (is_pct & (last_rem < 0.2)) | (~is_pct & (days < 3))
+    return np.where(alert, "🚨 立即下单 / Reorder now", "🟢 正常 / OK")
+
+
+# ---------- 物品详情：已按日期排序的子表取“某日之后”的一段 ----------
+def rows_since(d: pd.DataFrame, start: pd.Timestamp) -> pd.DataFrame:
+    """d 已按 日期 升序（NaT 排在最后）；二分查找起点后整段切片，不再整列比较。"""
+    n_dated = int(d["日期 (Date)"].count())
+    dates = d["日期 (Date)"].to_numpy()[:n_dated]
+    i = int(dates.searchsorted(pd.Timestamp(start).to_datetime64(), side="left"))
+    return d.iloc[i:n_dated]
 
 
 # ================ APP UI =======================
@@ -200,11 +272,11 @@ with tabs[0]:
     st.subheader("录入新记录 / New Record")
 
     # 读取“购入/剩余 Purchased/Remaining”用于推断已有物品（当没有主数据时）
+    # 只依赖规范化，不经过统计流水线：明细缺日期列时也能列出已有物品
     try:
-        df_all = read_records_fn()
-        df_all = normalize_columns_compute(df_all)  # 使用 compute 的强力清洗
+        latest_per_item = _latest_per_item(load_normalized(read_records_fn()))
     except Exception:
-        df_all = pd.DataFrame()
+        latest_per_item = pd.DataFrame()
 
     # 主数据（库存产品 In stock products）
     try:
@@ -219,30 +291,24 @@ with tabs[0]:
 
     # 构造可编辑表：优先主数据，否则历史记录中该类的最近单位
     if not catalog.empty and {"物品名", "单位", "类型"}.issubset(catalog.columns):
-        catalog = catalog.copy()
-        catalog["类型"] = catalog["类型"].apply(normalize_cat)
-        base = (catalog[catalog["类型"] == sel_type][["物品名", "单位"]]
+        # 类别只在单独的 Series 上归一，不在主数据表上改列
+        cat_type = normalize_cat_col(catalog["类型"])
+        base = (catalog.loc[cat_type == sel_type, ["物品名", "单位"]]
                 .drop_duplicates()
                 .reset_index(drop=True))
     else:
-        if not df_all.empty:
-            tmp = df_all.copy()
-            if "分类 (Category)" not in tmp.columns:
-                tmp["分类 (Category)"] = DEFAULT_CAT
-            tmp["分类 (Category)"] = tmp["分类 (Category)"].apply(normalize_cat)
-            latest_unit = (
-                safe_sort(tmp[tmp["分类 (Category)"] == sel_type], "日期 (Date)")
-                .groupby("食材名称 (Item Name)")["单位 (Unit)"]
-                .agg(lambda s: s.dropna().iloc[-1] if len(s.dropna()) else "")
-                .reset_index()
-                .rename(columns={"食材名称 (Item Name)": "物品名", "单位 (Unit)": "单位"})
-            )
-            base = latest_unit
+        if not latest_per_item.empty and "单位 (Unit)" in latest_per_item.columns:
+            # 按物品最近一次的分类归类，单位取该物品最近一条非空单位；没有单位的补空串
+            in_type = latest_per_item[latest_per_item["分类 (Category)"] == sel_type]
+            base = pd.DataFrame({
+                "物品名": in_type.index,
+                "单位": in_type["单位 (Unit)"].astype(object).fillna("").to_numpy(),
+            })
         else:
             base = pd.DataFrame(columns=["物品名", "单位"])
 
     # ---------- 构造可编辑表 ----------
-    edit_df = base.copy()
+    edit_df = base  # base 是上面新建的表，可直接加列
     for col in ["物品名", "单位"]:
         if col not in edit_df.columns:
             edit_df[col] = ""
@@ -294,115 +360,83 @@ with tabs[0]:
     # 批量写入 Google Sheet
     if st.button("✅ 批量保存到『购入/剩余 Purchased/Remaining』"):
         dt = pd.to_datetime(sel_date)
-        payload = []
-        preview = []
-
-        for _, r in edited.iterrows():
-            name = str(r.get("物品名", "") or "").strip()
-            if not name:
-                continue
-
-            unit_in = str(r.get("单位", "") or "").strip()
-            qty_cell, unit_out, is_pct = to_qty_cell(r.get("数量", ""), unit_in)
-
-            # ---- 买入 / 剩余 的校验与落表值 ----
-            if sel_status == "买入Purchase":
-                # 允许百分比或纯数字；都必须 > 0
-                if is_pct:
-                    ratio = _pct_ratio(qty_cell)   # '50%' -> 0.5
-                    if not (pd.notna(ratio) and ratio > 0):
-                        continue
-                    qty_to_sheet = qty_cell       # 写 '50%' 到“数量”
-                    qty_for_cost = ratio          # 金额用 0.5 参与计算
-                else:
-                    try:
-                        qty_num = float(qty_cell)
-                    except Exception:
-                        qty_num = np.nan
-                    if not (pd.notna(qty_num) and qty_num > 0):
-                        continue
-                    qty_to_sheet = qty_num        # 写数字到“数量”
-                    qty_for_cost = qty_num        # 金额用数字
-            else:  # 剩余Remaining
-                # 剩余：允许百分比或数字（可=0）
-                if is_pct:
-                    qty_to_sheet = qty_cell       # '50%' 原样写回
-                else:
-                    try:
-                        qty_num = float(qty_cell)
-                    except Exception:
-                        qty_num = np.nan
-                    if pd.isna(qty_num):          # 剩余至少要能解析成数字(可=0)或是百分比
-                        continue
-                    qty_to_sheet = qty_num
-                qty_for_cost = None               # 剩余不计总价
-
-            # ---- 价格 / 总价 ----
-            price = None
-            total = None
-            if sel_status == "买入Purchase" and pd.notna(r.get("单价", np.nan)):
-                try:
-                    price = float(r["单价"])
-                except Exception:
-                    price = None
-                if price is not None:
-                    # 若是百分比买入，用 ratio 计算金额；否则用数字数量
-                    factor = qty_for_cost if qty_for_cost is not None else np.nan
-                    if pd.notna(factor):
-                        total = round(float(factor) * price, 2)
-
-            # ---- 组装写入行 ----
-            record = {
-                "日期 (Date)": f"=DATE({dt.year},{dt.month},{dt.day})",
-                "食材名称 (Item Name)": name,
-                "分类 (Category)": sel_type,
-                "数量 (Qty)": qty_to_sheet,            # 可能是数字，也可能是 '50%'
-                "单位 (Unit)": unit_out,               # 正常单位；若用户填了 % 则置空
-                "单价 (Unit Price)": "" if price is None else price,
-                "总价 (Total Cost)": "" if total is None else total,
-                "状态 (Status)": sel_status,
-                "备注 (Notes)": str(r.get("备注", "") or "").strip(),
-            }
-            payload.append(record)
-
-            # ---- 预览 ----
-            row_preview = {
-                "日期 Date": dt.date().isoformat(),
-                "物品名 Item": name,
-                "数量 Qty": qty_to_sheet,
-                "单位 Unit": unit_out,
-                "状态 Status": sel_status,
-            }
-            if sel_status == "买入Purchase":
-                row_preview["单价 Unit Price"] = "" if price is None else price
-                row_preview["总价 Total Cost"] = "" if total is None else total
-            preview.append(row_preview)
+
+        # ---- 整列解析与校验（不再 iterrows 逐行处理）----
+        rows = edited.assign(物品名=_text_col(edited["物品名"]), 备注=_text_col(edited["备注"]))
+        rows = rows[rows["物品名"] != ""]
+        q = to_qty_cells(rows["数量"], rows["单位"])
+
+        if sel_status == "买入Purchase":
+            # 允许百分比或纯数字；都必须 > 0。金额计算时百分比按 50% -> 0.5
+            qty_for_cost = q["num"].where(~q["is_pct"], q["num"] / 100.0)
+            keep = qty_for_cost > 0
+            price = pd.to_numeric(rows["单价"], errors="coerce") if "单价" in rows.columns else pd.Series(np.nan, index=rows.index)
+            total = (qty_for_cost * price).round(2)
+        else:  # 剩余Remaining
+            # 剩余：允许百分比或数字（可=0），剩余不计总价
+            keep = q["is_pct"] | q["num"].notna()
+            price = total = pd.Series(np.nan, index=rows.index)
+
+        rows, q, price, total = rows[keep], q[keep], _blank_na(price[keep]), _blank_na(total[keep])
+
+        # 按 SHEET_COLS 顺序预分配二维数组，逐列切片填充（数量可能是数字，也可能是 '50%'；单位若填了 % 则置空）
+        payload = np.empty((len(rows), len(SHEET_COLS)), dtype=object)
+        if len(rows):
+            col = SHEET_COLS.index
+            payload[:, col("日期 (Date)")] = f"=DATE({dt.year},{dt.month},{dt.day})"
+            payload[:, col("食材名称 (Item Name)")] = rows["物品名"].to_numpy(dtype=object)
+            payload[:, col("分类 (Category)")] = sel_type
+            payload[:, col("数量 (Qty)")] = q["qty_cell"].to_numpy(dtype=object)
+            payload[:, col("单位 (Unit)")] = q["unit_out"].to_numpy(dtype=object)
+            payload[:, col("单价 (Unit Price)")] = price.to_numpy(dtype=object)
+            payload[:, col("总价 (Total Cost)")] = total.to_numpy(dtype=object)
+            payload[:, col("状态 (Status)")] = sel_status
+            payload[:, col("备注 (Notes)")] = rows["备注"].to_numpy(dtype=object)
+
+        # ---- 预览 ----
+        pre_df = pd.DataFrame({
+            "日期 Date": dt.date().isoformat(),
+            "物品名 Item": rows["物品名"],
+            "数量 Qty": q["qty_cell"],
+            "单位 Unit": q["unit_out"],
+            "单价 Unit Price": price,
+            "总价 Total Cost": total,
+            "状态 Status": sel_status,
+        })
 
         # 3) 批量写入 + 显示写入明细 + 回读校验
         try:
-            if payload:
-                resp = append_records_bulk(payload)  # gsheet 内部已用 USER_ENTERED + table_range="A1"
+            if len(payload):
+                resp = append_values_bulk(payload.tolist())  # gsheet 内部已用 USER_ENTERED + table_range="A1"
                 st.success(f"已成功写入 {len(payload)} 条记录！/ Successfully inserted {len(payload)} rows.")
                 st.caption(f"目标表 Target sheet：{st.secrets.get('INVENTORY_SHEET_URL') or os.getenv('INVENTORY_SHEET_URL')}")
 
                 # 显示 Google 返回的写入区间（用于定位）
-                from gsheet import parse_updated_range_rows, tail_rows
+                from gsheet import parse_updated_range_rows, batch_readback
                 rng = resp.get("updates", {}).get("updatedRange", "")
                 st.caption(f"Google 返回写入区间 Updated range：{rng}")
                 rows_info = parse_updated_range_rows(resp)
                 if rows_info:
                     st.caption(f"（起止行号 Row range：{rows_info[0]}–{rows_info[1]}）")
 
+                # 表尾快照 + 回读明细：一次请求拿回（append 内部已清空读缓存）
+                try:
+                    tail_df, df_check = batch_readback(10)
+                except Exception:
+                    tail_df, df_check = pd.DataFrame(), pd.DataFrame()
+
                 # 表尾快照
                 with st.expander("🔎 表尾快照（最近 10 行） / Tail snapshot (last 10 rows)", expanded=False):
-                    st.dataframe(tail_rows(10), use_container_width=True)
+                    st.dataframe(tail_df, use_container_width=True)
 
                 # 本次写入的记录（预览）
-                pre_df = pd.DataFrame(preview)
                 if sel_status == "买入Purchase":
                     pre_df = pre_df[["日期 Date", "物品名 Item", "数量 Qty", "单位 Unit", "单价 Unit Price", "总价 Total Cost", "状态 Status"]]
-                    with pd.option_context("mode.use_inf_as_na", True):
-                        total_spent = pd.to_numeric(pre_df.get("总价 Total Cost"), errors="coerce").sum()
+                    total_spent = (
+                        pd.to_numeric(pre_df["总价 Total Cost"], errors="coerce")
+                          .replace([np.inf, -np.inf], np.nan)
+                          .sum()
+                    )
                     st.caption(f"本次买入合计金额 Total purchase amount：{total_spent:.2f}")
                 else:
                     pre_df = pre_df[["日期 Date", "物品名 Item", "数量 Qty", "单位 Unit", "状态 Status"]]
@@ -411,20 +445,15 @@ with tabs[0]:
 
                 # 回读校验
                 try:
-                    bust_cache()
-                except Exception:
-                    pass
-                try:
-                    df_check = read_records_fn()
                     df_check = normalize_columns_compute(df_check)
                     dd = pd.to_datetime(df_check.get("日期 (Date)"), errors="coerce").dt.date
-                    names = [p["物品名 Item"] for p in preview]
+                    names = pre_df["物品名 Item"].tolist()
 
                     just_now = df_check[
                         (dd == dt.date()) &
                         (df_check.get("状态 (Status)") == sel_status) &
                         (df_check.get("食材名称 (Item Name)").isin(names))
-                    ][["日期 (Date)","食材名称 (Item Name)","数量 (Qty)","状态 (Status)"]].copy()
+                    ][["日期 (Date)","食材名称 (Item Name)","数量 (Qty)","状态 (Status)"]]
 
                     st.markdown("**写入后的回读校验 / Read-back check**")
                     if just_now.empty:
@@ -449,12 +478,17 @@ with tabs[1]:
             bust_cache()
         except Exception:
             pass
+        read_catalog_fn.clear()
         st.rerun()
 
-    # 读明细并统一列名 —— 使用 compute 的规范化
+    # 本次运行的“今天”（0 点）与图表回看起点，详情区共用
+    TODAY = pd.Timestamp.today().normalize()
+    LOOKBACK_60 = TODAY - pd.Timedelta(days=60)
+
+    # 读明细 -> 统一列名（load_normalized，与录入页共用缓存）-> 统计表（prepare_stats）：两段都按数据指纹缓存
     try:
-        df = read_records_fn()
-        df = normalize_columns_compute(df)
+        df = load_normalized(read_records_fn())
+        stats_by_cat, item_groups = prepare_stats(df)
     except Exception as e:
         st.error(f"读取表格失败 Read sheet failed：{e}")
         st.stop()
@@ -471,115 +505,35 @@ with tabs[1]:
         if not df.empty:
             st.dataframe(df.head(10), use_container_width=True)
 
-    # 兜底分类
-    if "分类 (Category)" not in df.columns:
-        df["分类 (Category)"] = DEFAULT_CAT
-    else:
-        df["分类 (Category)"] = df["分类 (Category)"].apply(normalize_cat)
-
-    # 统计表
-    stats_all = compute_stats(df)
-
-    # 附上“类型”列用于筛选（取该物品最近一次的分类）
-    if not df.empty and "食材名称 (Item Name)" in df.columns:
-        latest_cat = (
-            df.sort_values("日期 (Date)")
-              .groupby("食材名称 (Item Name)")["分类 (Category)"]
-              .agg(lambda s: s.dropna().iloc[-1] if len(s.dropna()) else DEFAULT_CAT)
-        )
-        stats_all = stats_all.merge(
-            latest_cat.rename("类型"),
-            left_on="食材名称 (Item Name)", right_index=True, how="left"
-        )
-    else:
-        stats_all["类型"] = DEFAULT_CAT
-    stats_all["类型"] = stats_all["类型"].apply(normalize_cat)
-
     # ---------- 固定显示顺序：来自『库存产品』的行顺序 ----------
     def _norm_name(s):
         # 去前后空格 + 去除所有空白字符，避免“看不见的空格”影响匹配
         return (str(s) if s is not None else "").strip().replace(" ", "")
 
     try:
-        order_df = read_catalog_fn().copy()
+        order_df = read_catalog_fn()
     except Exception:
         order_df = pd.DataFrame()
 
     if not order_df.empty and "物品名" in order_df.columns:
-        order_df["类型"] = order_df.get("类型", "").apply(normalize_cat)
-        order_df["name_norm"] = order_df["物品名"].map(_norm_name)
-        order_df["__order__"] = np.arange(len(order_df), dtype=float)
-        order_map = dict(zip(order_df["name_norm"], order_df["__order__"]))
+        order_map = dict(zip(order_df["物品名"].map(_norm_name),
+                             np.arange(len(order_df), dtype=float)))
     else:
         order_map = {}
 
     BIG = float(1e9)  # 匹配不到的放到最后
-    stats_all["name_norm"] = stats_all["食材名称 (Item Name)"].map(_norm_name)
-    stats_all["__order__"] = stats_all["name_norm"].map(order_map).fillna(BIG)
 
     # === 筛选条（作用于下方结果表） ===
     st.markdown("#### 筛选 / Filters")
     fc1, _ = st.columns([1, 3])
     sel_type_bar = fc1.selectbox("选择分类 Category", ["全部"] + ALLOWED_CATS, index=0)
 
-    stats = stats_all if sel_type_bar == "全部" else stats_all[stats_all["类型"].eq(sel_type_bar)]
-    stats = stats.copy()
-
-    # 预警规则：百分比(<20%)；非百分比(预计还能用天数<3)
-    def _is_percent_row(row: pd.Series) -> bool:
-        name = str(row.get("食材名称 (Item Name)", "") or "")
-        unit = str(row.get("单位 (Unit)", "") or "").strip()
-        last_rem = pd.to_numeric(row.get("最近剩余数量"), errors="coerce")
-    
-        # 1) 名称里带“糖浆 Syrup”直接按百分比处理
-        if "糖浆" in name:
-            return True
-    
-        # 2) 单位明确是百分比
-        if unit in {"%", "％", "百分比", "percent", "ratio"}:
-            return True
-    
-        # 3) 统计表里多数百分比行单位是空串；允许统计溢出到 150%（1.5）
-        if unit == "" and pd.notna(last_rem) and 0.0 <= float(last_rem) <= 1.5:
-            return True
-
-        return False
+    stats_all = stats_by_cat["全部"]
+    stats = stats_by_cat.get(sel_type_bar, stats_all.iloc[:0])
+    name_norm = stats["食材名称 (Item Name)"].map(_norm_name)
+    stats = stats.assign(name_norm=name_norm, __order__=name_norm.map(order_map).fillna(BIG))
 
-    def _unit_norm(u: str) -> str:
-        """单位统一：去空格、小写。"""
-        return str(u or "").strip().lower()
-    
-    def badge_row(row: pd.Series) -> str:
-        # ===== 饮品类优先规则 =====
-        if str(row.get("类型", "")).strip() == "饮品类Beverage":
-            unit = _unit_norm(row.get("单位 (Unit)"))
-            cur = pd.to_numeric(row.get("当前库存"), errors="coerce")
-    
-            if pd.notna(cur):
-                s = float(cur)
-                # 单位是“箱 Box”时，小于 2 报警
-                if unit in {"箱", "box"} and s < 2:
-                    return "🚨 立即下单 / Reorder now"
-                # 单位是“瓶/袋 Bottle/Bag”时，小于 6 报警
-                if unit in {"瓶", "袋", "bottle", "bag"} and s < 6:
-                    return "🚨 立即下单 / Reorder now"
-            # 饮品类但不符合上面两个条件 -> 走通用规则继续判断
-    
-        # ===== 通用规则（非饮品类，或饮品类未触发上面的阈值）=====
-        # 1) 百分比物料：最近剩余数量 < 20% 报警
-        if _is_percent_row(row):
-            val = pd.to_numeric(row.get("最近剩余数量"), errors="coerce")
-            if pd.notna(val) and float(val) < 0.2:
-                return "🚨 立即下单 / Reorder now"
-            return "🟢 正常 / OK"
-    
-        # 2) 非百分比：预计还能用天数 < 3 天 报警
-        days = pd.to_numeric(row.get("预计还能用天数"), errors="coerce")
-        if pd.notna(days) and float(days) < 3:
-            return "🚨 立即下单 / Reorder now"
-        return "🟢 正常 / OK"
-
-    stats["库存预警"] = stats.apply(badge_row, axis=1) if not stats.empty else ""
+    stats["库存预警"] = stock_alerts(stats)
 
     # —— 在固定顺序下排序（只按 __order__；mergesort 保持稳定）
     stats_sorted = stats.sort_values("__order__", kind="mergesort")
@@ -595,7 +549,7 @@ with tabs[1]:
         "预计还能用天数", "最近统计剩余日期", "最近采购日期",
         "最近采购数量", "最近采购单价", "平均采购间隔(天)", "累计支出", "库存预警"
     ]
-    show = stats_sorted[[c for c in display_cols if c in stats_sorted.columns]].copy()
+    show = stats_sorted[[c for c in display_cols if c in stats_sorted.columns]]
 
     if show.empty:
         st.info("暂无统计结果。请检查『购入/剩余 Purchased/Remaining』表的表头/数据是否完整。 / No statistics yet, please check the Purchased/Remaining sheet.")
@@ -616,38 +570,42 @@ with tabs[1]:
             "库存预警": "库存预警\nStock Alert",
         }
         show_display = show.rename(columns=header_rename)
-        render_centered_table(show_display)
+        render_table_2dp(show_display)
 
     # ============ 下钻：物品详情 ============
     st.markdown("### 🔍 物品详情 / Item details")
-    detail_items = ["（不选）"] + (list(show["食材名称 (Item Name)"].dropna().unique()) if "食材名称 (Item Name)" in show.columns else [])
+    if "食材名称 (Item Name)" in show.columns:
+        names_arr = show["食材名称 (Item Name)"].to_numpy()
+        detail_items = ["（不选）"] + pd.unique(names_arr[pd.notna(names_arr)]).tolist()
+    else:
+        detail_items = ["（不选）"]
     picked = st.selectbox("选择一个物品查看详情 / Pick an item", detail_items, index=0)
 
     if picked and picked != "（不选）":
-        # 统一口径的“当前库存” = 最后一次剩余 + 之后买入
-        item_df = normalize_columns_compute(df[df["食材名称 (Item Name)"] == picked].copy())
+        item_df = df.iloc[item_groups.get(picked, [])]  # df 在本页顶部已规范化，无需再跑一遍
         item_df = item_df.reset_index(drop=False).rename(columns={"index": "__orig_idx__"})
         if "row_order" not in item_df.columns:
             item_df["row_order"] = item_df["__orig_idx__"]
-        item_df = item_df.sort_values(["日期 (Date)", "row_order"])
+            # 行位置按原表顺序递增、row_order 就是原行号：按日期一次稳定排序即等价于 (日期, row_order)
+            item_df = item_df.sort_values("日期 (Date)", kind="mergesort")
+        else:
+            item_df = item_df.sort_values(["日期 (Date)", "row_order"])
 
         # 使用规范化后的状态值：买入Purchase / 剩余Remaining
-        rem = item_df[item_df.get("状态 (Status)") == "剩余Remaining"].copy()
-        buy = item_df[item_df.get("状态 (Status)") == "买入Purchase"].copy()
-
-        if len(rem):
-            last_rem = rem.iloc[-1]
-            last_date = last_rem["日期 (Date)"]
-            last_ord  = last_rem["row_order"]
-            last_qty  = float(last_rem["数量 (Qty)"]) if pd.notna(last_rem["数量 (Qty)"]) else 0.0
-            mask_after = (
-                (item_df["日期 (Date)"] > last_date) |
-                ((item_df["日期 (Date)"] == last_date) & (item_df["row_order"] > last_ord))
-            )
-            buys_after = item_df[mask_after & (item_df["状态 (Status)"] == "买入Purchase")]
-            cur_stock = float(last_qty + buys_after["数量 (Qty)"].sum())
-        else:
-            cur_stock = float(buy["数量 (Qty)"].sum()) if len(buy) else float("nan")
+        # 一次分组拿到各状态的行位置（保持日期顺序），代替两次整列字符串比较
+        by_status = item_df.groupby("状态 (Status)", sort=False, observed=True).indices
+        rem = item_df.iloc[by_status.get("剩余Remaining", [])]
+        buy = item_df.iloc[by_status.get("买入Purchase", [])]
+
+        # 当前库存 / 14天用量 / 还能用天数 / 平均采购间隔：统计表里已按同一口径（无日期的行不参与）算好，
+        # 全部取该物品那一行，KPI 之间不会一半用全部行、一半只用有日期的行
+        hit = stats_all.loc[stats_all["食材名称 (Item Name)"] == picked]
+        row = hit.iloc[0] if len(hit) else None
+        cur_stock = float(row["当前库存"]) if row is not None else np.nan
+        use14 = float(row["平均最近两周使用量"]) if row is not None else np.nan
+        use14 = None if np.isnan(use14) else use14
+        days_left = float(row["预计还能用天数"]) if row is not None else np.nan
+        avg_interval = float(row["平均采购间隔(天)"]) if row is not None else np.nan
 
         last_buy = buy.iloc[-1] if len(buy) else None
         last_buy_date = (last_buy["日期 (Date)"].date().isoformat()
@@ -655,16 +613,9 @@ with tabs[1]:
         last_buy_qty  = float(last_buy["数量 (Qty)"]) if last_buy is not None else np.nan
         last_buy_price = float(last_buy["单价 (Unit Price)"]) if (last_buy is not None and "单价 (Unit Price)" in item_df.columns) else np.nan
 
-        use14 = _recent_usage_14d_new(item_df)
-        days_left = (cur_stock / (use14 / 14.0)) if (use14 and use14 > 0 and not np.isnan(cur_stock)) else np.nan
-        stockout_date = (pd.Timestamp.today().normalize() + pd.Timedelta(days=float(days_left))).date().isoformat() \
+        stockout_date = (TODAY + pd.Timedelta(days=float(days_left))).date().isoformat() \
                         if days_left == days_left else "—"
 
-        if len(buy) >= 2:
-            avg_interval = buy["日期 (Date)"].diff().dt.days.dropna().mean()
-        else:
-            avg_interval = np.nan
-
         # KPI
         k1, k2, k3, k4, k5, k6 = st.columns(6)
         k1.metric("当前库存 Current stock", f"{0 if np.isnan(cur_stock) else cur_stock}")
@@ -674,38 +625,42 @@ with tabs[1]:
         k5.metric("最近采购日期 Last purchase date", last_buy_date)
         k6.metric("平均采购间隔(天) Avg purchase interval (days)", "—" if np.isnan(avg_interval) else f"{avg_interval:.1f}")
 
-        # 库存轨迹（近60天）
-        lookback = pd.Timestamp.today().normalize() - pd.Timedelta(days=60)
-        rem60 = rem[rem["日期 (Date)"] >= lookback].copy()
-        if not rem60.empty:
-            rem60["dt"] = pd.to_datetime(rem60["日期 (Date)"])
-            chart_stock = alt.Chart(rem60).mark_line(point=True).encode(
-                x=alt.X("dt:T", title="日期 Date"),
-                y=alt.Y("数量 (Qty):Q", title="剩余数量 Remaining Qty")
-            ).properties(title=f"{picked} — 剩余数量（近60天） / Remaining stock (last 60 days)")
-            st.altair_chart(chart_stock, use_container_width=True)
-
-        # 事件时间线（近60天）
-        ev = item_df[item_df["日期 (Date)"] >= lookback][["日期 (Date)", "状态 (Status)", "数量 (Qty)", "单价 (Unit Price)"]].copy()
-        if not ev.empty:
-            ev["dt"] = pd.to_datetime(ev["日期 (Date)"])
-            status_color = alt.Color(
-                "状态 (Status):N",
-                scale=alt.Scale(domain=["买入Purchase", "剩余Remaining"], range=["#1f77b4", "#E4572E"]),
-                legend=alt.Legend(title="状态 Status")
-            )
-            chart_ev = alt.Chart(ev).mark_point(filled=True, size=80).encode(
-                x=alt.X("dt:T", title="日期 Date"),
-                y=alt.Y("数量 (Qty):Q", title="数量 Qty"),
-                color=status_color,
-                shape="状态 (Status):N",
-                tooltip=["状态 (Status)", "数量 (Qty)", "单价 (Unit Price)", "日期 (Date)"]
-            ).properties(title=f"{picked} — 事件时间线（近60天） / Events in last 60 days")
-            st.altair_chart(chart_ev, use_container_width=True)
+        # 图表默认收起：打开开关（状态记在 session_state）后才构建 Altair 图表，
+        # 快速切换物品时省去 Vega-Lite 规格生成与 JSON 序列化
+        if st.toggle("📈 库存/事件图表 / Stock & event charts", value=False, key="show_item_charts"):
+            # 库存轨迹（近60天）；日期列已由 normalize_columns 解析为 datetime64，直接使用
+            # 只把画图用到的列交给 Altair，其余列（备注、分类等）不进 Vega-Lite JSON
+            rem60 = rows_since(rem, LOOKBACK_60)[["日期 (Date)", "数量 (Qty)"]]
+            # 同一天多次盘点只画当天最后一次：每天最多一个点
+            rem60 = rem60.resample("D", on="日期 (Date)")["数量 (Qty)"].last().dropna().reset_index()
+            if not rem60.empty:
+                chart_stock = alt.Chart(rem60).mark_line(point=True).encode(
+                    x=alt.X("日期 (Date):T", title="日期 Date"),
+                    y=alt.Y("数量 (Qty):Q", title="剩余数量 Remaining Qty")
+                ).properties(title=f"{picked} — 剩余数量（近60天） / Remaining stock (last 60 days)")
+                st.altair_chart(chart_stock, use_container_width=True)
+
+            # 事件时间线（近60天）
+            # 事件点最多画最近 200 个（已按日期升序）
+            ev = rows_since(item_df, LOOKBACK_60)[["日期 (Date)", "状态 (Status)", "数量 (Qty)", "单价 (Unit Price)"]].tail(200)
+            if not ev.empty:
+                status_color = alt.Color(
+                    "状态 (Status):N",
+                    scale=alt.Scale(domain=["买入Purchase", "剩余Remaining"], range=["#1f77b4", "#E4572E"]),
+                    legend=alt.Legend(title="状态 Status")
+                )
+                chart_ev = alt.Chart(ev).mark_point(filled=True, size=80).encode(
+                    x=alt.X("日期 (Date):T", title="日期 Date"),
+                    y=alt.Y("数量 (Qty):Q", title="数量 Qty"),
+                    color=status_color,
+                    shape="状态 (Status):N",
+                    tooltip=["状态 (Status)", "数量 (Qty)", "单价 (Unit Price)", "日期 (Date)"]
+                ).properties(title=f"{picked} — 事件时间线（近60天） / Events in last 60 days")
+                st.altair_chart(chart_ev, use_container_width=True)
 
         # 最近记录（原始）
         st.markdown(" ")
         st.markdown("#### 最近记录（原始） / Recent raw records")
         cols = ["日期 (Date)", "状态 (Status)", "数量 (Qty)", "单位 (Unit)", "单价 (Unit Price)", "总价 (Total Cost)", "分类 (Category)", "备注 (Notes)"]
         cols = [c for c in cols if c in item_df.columns]
-        st.dataframe(item_df[cols].sort_values("日期 (Date)").iloc[::-1].head(10), use_container_width=True)
+        st.dataframe(item_df[cols].tail(10).iloc[::-1], use_container_width=True)  # item_df 已按日期升序
@@ -3,10 +3,33 @@
 from __future__ import annotations
 
 import re
+import math
+from functools import lru_cache
 from typing import Optional
 import pandas as pd
 import numpy as np
 
+# 可选：装了 numba 就把数组内核编译成机器码；没装则按纯 Python 循环运行，结果一致
+# numba 不在 requirements.txt 里（见 README“可选：numba 加速”），生产环境未安装时走的就是纯 Python 路径
+try:
+    from numba import njit, prange
+except Exception:
+    njit = None
+    prange = range
+
+
+def _jit(fn, **opts):
+    """
+    用 numba 编译数组内核（编译结果缓存到磁盘，目录可用 NUMBA_CACHE_DIR 指定）。
+    部署目录只读、缓存无处可写时退回不落盘的编译；numba 未安装时原样返回 fn。
+    """
+    if njit is None:
+        return fn
+    try:
+        return njit(cache=True, **opts)(fn)
+    except Exception:
+        return njit(**opts)(fn)
+
 # ======================== 列名规范化（含脏数据清洗） ========================
 
 _NBSP = "\xa0"
@@ -24,31 +47,47 @@ _CANONICAL = {
     "状态 (Status)": ["状态", "status", "Status", "状态(Status)"],
     "备注 (Notes)": ["备注", "notes", "note", "Notes", "备注(Notes)"],
 }
-_FLAT = {k.lower(): k for k in _CANONICAL}
-for k, alts in _CANONICAL.items():
-    for a in alts:
-        _FLAT[a.lower()] = k
+_CATEGORY_COLS = ("分类 (Category)", "状态 (Status)", "单位 (Unit)")
+
+# 表头清洗：单字符替换走 str.translate（不换行空格 -> 空格、全角括号 -> 半角、去掉零宽空格），
+# 正则在模块加载时编译一次
+_TOKEN_TRANS = str.maketrans({_NBSP: " ", _FULL_L: "(", _FULL_R: ")", "\u200B": None})
+_RE_BEFORE_PAREN = re.compile(r"([\u4e00-\u9fffA-Za-z0-9])\(")
+_RE_AFTER_PAREN = re.compile(r"\)\s*([A-Za-z0-9\u4e00-\u9fff])")
+_RE_INSIDE_PAREN = re.compile(r"\(\s*([^)]+?)\s*\)")
+_RE_SPACES = re.compile(r"\s+")
 
 
 def _clean_token(s: str) -> str:
     if s is None:
         return ""
     s = str(s)
-    s = (
-        s.replace(_NBSP, " ")
-         .replace(_FULL_L, "(")
-         .replace(_FULL_R, ")")
-         .replace("\u200B", "")
-    )
+    s = s.translate(_TOKEN_TRANS)
     # 括号前缺空格 -> 补空格；括号后紧接文字 -> 补空格
-    s = re.sub(r"([\u4e00-\u9fffA-Za-z0-9])\(", r"\1 (", s)
-    s = re.sub(r"\)\s*([A-Za-z0-9\u4e00-\u9fff])", r") \1", s)
+    s = _RE_BEFORE_PAREN.sub(r"\1 (", s)
+    s = _RE_AFTER_PAREN.sub(r") \1", s)
     # 括号内部收紧空格
-    s = re.sub(r"\(\s*([^)]+?)\s*\)", r"(\1)", s)
-    s = re.sub(r"\s+", " ", s.strip())
+    s = _RE_INSIDE_PAREN.sub(r"(\1)", s)
+    s = _RE_SPACES.sub(" ", s.strip())
     return s
 
 
+# 别名 -> 标准列的反查表，导入时建一次。键同时收录原始写法和清洗后的写法（小写）：
+# normalize_columns 查的是清洗后的表头，像“单价(元)”清洗后变成“单价 (元)”，只按原写法建键会匹配不上
+_FLAT = {}
+for k, alts in _CANONICAL.items():
+    for a in (k, *alts):
+        _FLAT[a.lower()] = k
+        _FLAT[_clean_token(a).lower()] = k
+
+
+@lru_cache(maxsize=1024, typed=True)
+def _std_header(c) -> str:
+    """单个表头 -> 标准列名（认不出的返回清洗后的原名）。表格每次重读表头都一样，按原表头缓存。"""
+    c0 = _clean_token(c)
+    return _FLAT.get(c0.lower(), c0)
+
+
 def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
     """
     把各类变体表头统一为标准列；把日期/数字列转为合适类型。
@@ -60,20 +99,27 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
         return df.copy()
 
     # ---- 表头规范化 ----
-    cols = []
-    for c in df.columns:
-        c0 = _clean_token(c)
-        cols.append(_FLAT.get(c0.lower(), c0))
-    out = df.copy()
+    cols = [_std_header(c) for c in df.columns]
+    # 浅拷贝即可：下面只整列替换（不原地写入），不会改到调用方的 df
+    out = df.copy(deep=False)
     out.columns = cols
+    # 已规范化过的 df 再次传入时，类别列先还原为普通对象列，保证下面的字符串清洗逻辑一致
+    for col in _CATEGORY_COLS:
+        if col in out.columns and isinstance(out[col].dtype, pd.CategoricalDtype):
+            out[col] = out[col].astype(object)
 
     # ---- 日期列 ----
-    if "日期 (Date)" in out.columns:
+    # 已是 datetime64 时跳过（例如已规范化过的 df），省去整列重新分配
+    if "日期 (Date)" in out.columns and not pd.api.types.is_datetime64_any_dtype(out["日期 (Date)"]):
         out["日期 (Date)"] = pd.to_datetime(out["日期 (Date)"], errors="coerce")
 
     # ---- 数值列统一："30%"->0.3；"1,234.5"->1234.5 ----
     for col in ["数量 (Qty)", "单价 (Unit Price)", "总价 (Total Cost)"]:
         if col in out.columns:
+            # 已是整数 / float64 列：没有千分位和百分号可处理，直接转 float 即可
+            if out[col].dtype.kind in "iu" or out[col].dtype == np.float64:
+                out[col] = out[col].astype(np.float64)
+                continue
             s = out[col].astype(str).str.replace(",", "", regex=False).str.strip()
             is_pct = s.str.endswith("%", na=False)
             s = pd.to_numeric(s.str.rstrip("%"), errors="coerce")
@@ -98,6 +144,12 @@ def normalize_columns(df: pd.DataFrame) -> pd.DataFrame:
 
         out["状态 (Status)"] = norm
 
+    # ---- 低基数文本列转 category：比较/分组走整数编码，内存也小得多 ----
+    # 物品名不转：compute_stats 过滤掉无日期行后按物品分组，category 会多出空组
+    for col in _CATEGORY_COLS:
+        if col in out.columns:
+            out[col] = out[col].astype("category")
+
     return out
 
 
@@ -107,74 +159,145 @@ def _with_row_order(df: pd.DataFrame) -> pd.DataFrame:
     """确保存在 row_order 列，并按 日期 + row_order 升序返回副本。"""
     if df is None or df.empty:
         return df.copy()
-    x = df.copy().reset_index(drop=False).rename(columns={"index": "__orig_idx__"})
+    x = df.reset_index(drop=False).rename(columns={"index": "__orig_idx__"})
     if "row_order" not in x.columns:
         x["row_order"] = x["__orig_idx__"]
-    if "日期 (Date)" in x.columns:
+    if "日期 (Date)" in x.columns and not pd.api.types.is_datetime64_any_dtype(x["日期 (Date)"]):
         x["日期 (Date)"] = pd.to_datetime(x["日期 (Date)"], errors="coerce")
     return x.sort_values(["日期 (Date)", "row_order"]).reset_index(drop=True)
 
 
-def _between_mask(df: pd.DataFrame,
-                  start_date, start_ord: int,
-                  end_date, end_ord: int,
-                  include_start: bool = False,
-                  include_end: bool = False) -> pd.Series:
-    """日期+行号开闭区间掩码。"""
-    # 左端
-    left = (df["日期 (Date)"] > start_date) | (
-        (df["日期 (Date)"] == start_date) & (df["row_order"] > start_ord)
-    )
-    if include_start:
-        left = (df["日期 (Date)"] > start_date) | (
-            (df["日期 (Date)"] == start_date) & (df["row_order"] >= start_ord)
-        )
-    # 右端
-    right = (df["日期 (Date)"] < end_date) | (
-        (df["日期 (Date)"] == end_date) & (df["row_order"] < end_ord)
+_ST_OTHER, _ST_REM, _ST_BUY = 0, 1, 2
+_NAT_TICKS = np.iinfo(np.int64).min  # NaT 的 int64 表示
+
+
+def _status_codes(status: pd.Series) -> np.ndarray:
+    return np.select(
+        [status.eq("剩余Remaining").to_numpy(), status.eq("买入Purchase").to_numpy()],
+        [_ST_REM, _ST_BUY], default=_ST_OTHER
+    ).astype(np.int8)
+
+
+def _date_ticks(dates: pd.Series):
+    """datetime64 列 -> (int64 刻度, 一天的刻度数)。"""
+    arr = dates.to_numpy()
+    unit = np.datetime_data(arr.dtype)[0]
+    day = int(np.timedelta64(1, "D").astype(f"timedelta64[{unit}]").astype(np.int64))
+    return arr.view(np.int64), day
+
+
+def _rule_arrays(x: pd.DataFrame):
+    """已排好序的物品明细 -> 两条规则共用的数组 (刻度, 一天刻度数, 状态码, 数量)。"""
+    ticks, day = _date_ticks(x["日期 (Date)"])
+    return (
+        ticks, day,
+        _status_codes(x["状态 (Status)"]),
+        x["数量 (Qty)"].to_numpy(dtype=np.float64, na_value=np.nan),
     )
-    if include_end:
-        right = (df["日期 (Date)"] < end_date) | (
-            (df["日期 (Date)"] == end_date) & (df["row_order"] <= end_ord)
-        )
-    return left & right
 
 
 # ======================== 规则 1：当前库存 ========================
 
-def _current_stock_rule(df_item: pd.DataFrame) -> Optional[float]:
+def _current_stock_core(ticks, status, qty) -> float:
     """
-    当前库存：
-      - 以最后一条“剩余Remaining”为基准：当前库存 = 该条“剩余”的数量 + 这条之后的所有“买入Purchase”数量之和
-      - 若没有任何“剩余Remaining”，则库存 = 全部“买入Purchase”数量之和
+    规则 1 的数组内核（输入已按 日期 + row_order 升序，NaT 在最后）：
+      最后一条剩余的数量（空记 0）+ 其后所有有日期的买入之和；
+      没有剩余时取全部买入之和，连买入也没有则为 NaN。
     """
-    x = _with_row_order(df_item)
+    n = len(ticks)
+    end = -1
+    for i in range(n - 1, -1, -1):
+        if status[i] == _ST_REM:
+            end = i
+            break
+    if end < 0:
+        has_buy = False
+        total = 0.0
+        for i in range(n):
+            if status[i] == _ST_BUY:
+                has_buy = True
+                if not math.isnan(qty[i]):
+                    total += qty[i]
+        return total if has_buy else np.nan
+
+    last_qty = 0.0 if math.isnan(qty[end]) else qty[end]
+    if ticks[end] == _NAT_TICKS:
+        return last_qty
+    sum_after = 0.0
+    for i in range(end + 1, n):
+        if status[i] == _ST_BUY and ticks[i] != _NAT_TICKS and not math.isnan(qty[i]):
+            sum_after += qty[i]
+    return last_qty + sum_after
+
+
+_current_stock_core = _jit(_current_stock_core)
 
-    rem = x[x["状态 (Status)"] == "剩余Remaining"]
-    buys = x[x["状态 (Status)"] == "买入Purchase"]
 
-    if rem.empty:
-        return float(buys["数量 (Qty)"].sum()) if not buys.empty else np.nan
+# ======================== 规则 2：平均最近两周使用量 ========================
 
-    last_rem = rem.iloc[-1]
-    last_date = last_rem["日期 (Date)"]
-    last_ord  = last_rem["row_order"]
-    last_qty  = float(last_rem["数量 (Qty)"]) if pd.notna(last_rem["数量 (Qty)"]) else 0.0
+def _usage_14d_core(ticks, status, qty, day) -> float:
+    """
+    规则 2 的数组内核（输入已按 日期 + row_order 升序，NaT 在最后）：
+      ticks  : int64 时间戳刻度；status : 0 其他 / 1 剩余 / 2 买入；qty : float64
+      day    : 一天对应的刻度数
+    返回 14 天用量；无法计算时返回 NaN。
+    """
+    n = len(ticks)
+    end = -1
+    for i in range(n - 1, -1, -1):
+        if status[i] == _ST_REM:
+            end = i
+            break
+    if end < 0:
+        return np.nan
+    end_qty = qty[end]
+    if math.isnan(end_qty):
+        return np.nan
+    # 最后一条剩余没有日期（NaT）时，窗口内外都找不到起点
+    if ticks[end] == _NAT_TICKS:
+        return np.nan
+    target = ticks[end] - 14 * day
+
+    # 窗口内第一条剩余作为默认起点；同时找“连续两次剩余、数量上升且其间无买入”的最后一对
+    start = -1
+    prev = -1
+    leak = -1
+    buy_between = False
+    for i in range(end + 1):
+        s = status[i]
+        if s == _ST_BUY:
+            buy_between = True
+        elif s == _ST_REM and ticks[i] >= target:
+            if start < 0:
+                start = i
+            if prev >= 0 and qty[i] > qty[prev] and not buy_between:
+                leak = i
+            prev = i
+            buy_between = False
+    if leak >= 0:
+        start = leak
+
+    start_qty = qty[start]
+    if math.isnan(start_qty):
+        return np.nan
 
-    BIG_ORD = 10**12
-    mask_after = _between_mask(
-        x,
-        start_date=last_date, start_ord=last_ord,
-        end_date=pd.Timestamp.max, end_ord=BIG_ORD,
-        include_start=False, include_end=True
-    )
-    buys_after = x[mask_after & (x["状态 (Status)"] == "买入Purchase")]
-    sum_after  = float(buys_after["数量 (Qty)"].sum()) if not buys_after.empty else 0.0
+    # 区间买入之和（开区间起点，闭区间终点）
+    sum_buys = 0.0
+    for i in range(start + 1, end):
+        if status[i] == _ST_BUY and not math.isnan(qty[i]):
+            sum_buys += qty[i]
+
+    days = (ticks[end] - ticks[start]) // day
+    if days <= 0:
+        return np.nan
+    used = sum_buys + start_qty - end_qty
+    if used < 0:
+        return np.nan
+    return used / days * 14.0
 
-    return float(last_qty + sum_after)
 
+_usage_14d_core = _jit(_usage_14d_core)
 
-# ======================== 规则 2：平均最近两周使用量 ========================
 
 def _usage_14d_rule(df_item: pd.DataFrame) -> Optional[float]:
     """
@@ -182,92 +305,62 @@ def _usage_14d_rule(df_item: pd.DataFrame) -> Optional[float]:
       - 若窗口内出现“连续两次剩余，第二次数量更大，且其间无买入”（视为漏记买入），从第二次剩余起算；
       - 否则选择最接近“14天前”的剩余（先窗口内；否则回退窗口外最近一条）。
       用量 = (期间买入之和 + 起点剩余 − 终点剩余) / 间隔天数 × 14
+    具体循环在 _usage_14d_core 中按数组完成。
     """
     x = _with_row_order(df_item)
     if x.empty:
         return None
 
-    rem = x[x["状态 (Status)"] == "剩余Remaining"]
-    if rem.empty:
-        return None
-
-    r_last = rem.iloc[-1]
-    end_date = r_last["日期 (Date)"]
-    end_ord  = r_last["row_order"]
-    end_qty  = float(r_last["数量 (Qty)"]) if pd.notna(r_last["数量 (Qty)"]) else None
-    if end_qty is None:
-        return None
-
-    target_start = end_date - pd.Timedelta(days=14)
-
-    # A. 漏记买入模式：窗口内 连续两次“剩余” & 第二次数量更大 & 其间无“买入Purchase”
-    rem_win = rem[
-        (rem["日期 (Date)"] >= target_start) & (rem["日期 (Date)"] <= end_date)
-    ].reset_index(drop=True)
-    leak_start_row = None
-    if len(rem_win) >= 2:
-        for i in range(len(rem_win) - 1):
-            r1, r2 = rem_win.iloc[i], rem_win.iloc[i + 1]
-            if float(r2["数量 (Qty)"]) > float(r1["数量 (Qty)"]):
-                mask_mid = _between_mask(
-                    x,
-                    start_date=r1["日期 (Date)"], start_ord=r1["row_order"],
-                    end_date=r2["日期 (Date)"], end_ord=r2["row_order"],
-                    include_start=False, include_end=False
-                )
-                if not any(x.loc[mask_mid, "状态 (Status)"] == "买入Purchase"):
-                    leak_start_row = r2
-    if leak_start_row is not None:
-        start_row = leak_start_row
-    else:
-        # B. 选最接近 target_start 的“剩余”：优先窗口内最早；否则窗口外向前最近
-        rem_all = rem[rem["日期 (Date)"] <= end_date].copy()
-        cand_in = rem_all[rem_all["日期 (Date)"] >= target_start]
-        if not cand_in.empty:
-            start_row = cand_in.sort_values(
-                ["日期 (Date)", "row_order"]
-            ).iloc[0]
-        else:
-            cand_out = rem_all[rem_all["日期 (Date)"] < target_start]
-            if cand_out.empty:
-                return None
-            start_row = cand_out.sort_values(
-                ["日期 (Date)", "row_order"]
-            ).iloc[-1]
-
-    start_date = start_row["日期 (Date)"]
-    start_ord  = start_row["row_order"]
-    start_qty  = float(start_row["数量 (Qty)"]) if pd.notna(start_row["数量 (Qty)"]) else None
-    if start_qty is None:
-        return None
+    ticks, day, status, qty = _rule_arrays(x)
+    res = _usage_14d_core(ticks, status, qty, day)
+    return None if math.isnan(res) else float(res)
 
-    # 区间买入之和（开区间起点，闭区间终点）
-    mask_period = _between_mask(
-        x,
-        start_date=start_date, start_ord=start_ord,
-        end_date=end_date,   end_ord=end_ord,
-        include_start=False, include_end=True
-    )
-    buys = x[mask_period & (x["状态 (Status)"] == "买入Purchase")]
-    sum_buys = float(buys["数量 (Qty)"].sum()) if not buys.empty else 0.0
 
-    days = (end_date - start_date).days
-    if days <= 0:
-        return None
-
-    used = sum_buys + start_qty - end_qty
-    if used < 0:
-        return None
-
-    daily = used / days
-    return float(daily * 14.0)
-
-
-# 兼容 app.py 的导入别名
+# 单个物品规则 2 的旧函数名
 def _recent_usage_14d_robust(df_item: pd.DataFrame) -> Optional[float]:
     return _usage_14d_rule(df_item)
 
 
+def _rules_by_item(starts, ends, n_rem, ticks, status, qty, day):
+    """
+    对按 物品码 + 日期 排好的整表数组，逐段 [starts[i], ends[i]) 计算两条规则。
+    n_rem[i] 为第 i 个物品的剩余条数：不足两条时起点只能是终点本身（间隔 0 天），
+    规则 2 必为 NaN，直接跳过窗口扫描。
+    返回 (当前库存, 最近14天用量) 两个数组，第 i 个元素对应第 i 个物品；无法计算为 NaN。
+    装了 numba（可选依赖）时整个循环编译执行，各物品互不依赖，可并行；未安装时按普通 Python 循环运行，结果一致。
+    """
+    n = len(starts)
+    cur = np.empty(n, dtype=np.float64)
+    use = np.full(n, np.nan)
+    for i in prange(n):
+        a, b = starts[i], ends[i]
+        cur[i] = _current_stock_core(ticks[a:b], status[a:b], qty[a:b])
+        if n_rem[i] >= 2:
+            use[i] = _usage_14d_core(ticks[a:b], status[a:b], qty[a:b], day)
+    return cur, use
+
+
+_rules_by_item = _jit(_rules_by_item, parallel=True)
+
+
+def _last_pos_per_item(mask: np.ndarray, starts: np.ndarray, ends: np.ndarray) -> np.ndarray:
+    """各物品段 [start, end) 内最后一个 mask 为真的行位置；没有则为 -1。"""
+    pos = np.flatnonzero(mask)
+    if len(pos) == 0:
+        return np.full(len(starts), -1, dtype=np.intp)
+    k = np.searchsorted(pos, ends) - 1
+    cand = pos[np.maximum(k, 0)]
+    return np.where((k >= 0) & (cand >= starts), cand, -1)
+
+
+def _take_at(values: np.ndarray, pos: np.ndarray, fill) -> np.ndarray:
+    """按行位置取值，位置为 -1 的填 fill。"""
+    out = np.full(len(pos), fill, dtype=values.dtype)
+    hit = pos >= 0
+    out[hit] = values[pos[hit]]
+    return out
+
+
 # ======================== 对外主函数 ========================
 
 def compute_stats(df: pd.DataFrame) -> pd.DataFrame:
@@ -295,84 +388,100 @@ def compute_stats(df: pd.DataFrame) -> pd.DataFrame:
             "平均采购间隔(天)", "累计支出", "单位 (Unit)", "最近剩余数量"
         ])
 
-    df = df[pd.notna(df["日期 (Date)"])].copy()
+    # 只保留统计用到的列（备注 / 分类等宽字符串列不参与后面的排序和切片）
+    used = must + ["单价 (Unit Price)", "总价 (Total Cost)", "单位 (Unit)", "row_order"]
+    df = df.loc[pd.notna(df["日期 (Date)"]), [c for c in used if c in df.columns]]
     # 主 DataFrame 也补齐 row_order，便于各函数使用
     if "row_order" not in df.columns:
         df = df.reset_index(drop=False).rename(columns={"index": "__orig_idx__"})
         df["row_order"] = df["__orig_idx__"]
 
-    rows = []
-    for item, g in df.groupby("食材名称 (Item Name)"):
-        g = _with_row_order(g)
-
-        # 最近剩余
-        rem = g[g["状态 (Status)"] == "剩余Remaining"]
-        last_rem_date = rem.iloc[-1]["日期 (Date)"] if not rem.empty else None
-        last_rem_qty  = float(rem.iloc[-1]["数量 (Qty)"]) if (
-            not rem.empty and pd.notna(rem.iloc[-1]["数量 (Qty)"])
-        ) else np.nan
-
-        # 最近买入信息
-        buy = g[g["状态 (Status)"] == "买入Purchase"]
-        last_buy_date  = buy.iloc[-1]["日期 (Date)"] if not buy.empty else None
-        last_buy_qty   = float(buy.iloc[-1]["数量 (Qty)"]) if (
-            not buy.empty and pd.notna(buy.iloc[-1]["数量 (Qty)"])
-        ) else np.nan
-        last_buy_price = float(buy.iloc[-1]["单价 (Unit Price)"]) if (
-            not buy.empty and pd.notna(buy.iloc[-1].get("单价 (Unit Price)", np.nan))
-        ) else np.nan
-
-        # 单位：最近一条非空
-        if "单位 (Unit)" in g.columns and len(g["单位 (Unit)"].dropna()):
-            last_unit = (
-                g["单位 (Unit)"]
-                .dropna()
-                .astype(str)
-                .replace("nan", "")
-                .iloc[-1]
-            )
-        else:
-            last_unit = ""
-
-        # 规则 1：当前库存
-        cur_stock = _current_stock_rule(g)
-
-        # 规则 2：最近14天用量
-        use14 = _usage_14d_rule(g)
-
-        # 还能用天数
-        days_left = np.nan
-        if use14 and use14 > 0 and cur_stock is not None and not np.isnan(cur_stock):
-            daily = use14 / 14.0
-            if daily > 0:
-                days_left = float(cur_stock / daily)
-
-        # 平均采购间隔 & 累计支出
-        avg_int = np.nan
-        if len(buy) >= 2:
-            diffs = buy["日期 (Date)"].diff().dt.days.dropna()
-            if not diffs.empty:
-                avg_int = float(diffs.mean())
-        total_spend_item = float(
-            buy.get("总价 (Total Cost)", pd.Series([], dtype=float)).sum()
+    # 全表按 日期 + row_order 稳定排序一次：各物品的行天然按时间先后排列，
+    # “最近一条剩余 / 买入 / 单位”即各物品段内最后一个满足条件的行位置，不再逐物品筛选
+    df = df.sort_values(["日期 (Date)", "row_order"], kind="mergesort")
+
+    # 物品名一次编码成整数（按名称排序，与原先 groupby 的输出顺序一致），之后分组/去重都用整数码；
+    # 空物品名编码为 -1，与 groupby 默认行为一样不参与统计
+    codes, item_names = pd.factorize(df["食材名称 (Item Name)"], sort=True)
+    # 物品名若是类别列：编码顺序沿用类别顺序（与按类别 groupby 一致），但输出列还原为普通对象列，
+    # 不把未出现的类别 / 类别 dtype 带到结果表里
+    if isinstance(item_names.dtype, pd.CategoricalDtype):
+        item_names = np.asarray(item_names, dtype=object)
+    df = df.assign(__item__=codes)[codes >= 0]
+    name = "__item__"
+
+    # 再按物品码稳定排序：整体次序变为 (物品, 日期, row_order)，每个物品占连续一段，
+    # 逐物品时直接切片，不再 groupby、也不再逐组排序
+    df = df.sort_values(name, kind="mergesort")
+    ticks, day, status, qty = _rule_arrays(df)
+    item_codes = df[name].to_numpy()
+    starts = np.flatnonzero(np.diff(item_codes, prepend=-1))
+    ends = np.r_[starts[1:], len(item_codes)]
+
+    # 每个物品最后一条剩余 / 买入 / 非空单位的行位置（没有则为 -1），之后按位置直接从数组取值
+    last_rem_pos = _last_pos_per_item(status == _ST_REM, starts, ends)
+    last_buy_pos = _last_pos_per_item(status == _ST_BUY, starts, ends)
+    dates = df["日期 (Date)"].to_numpy()
+
+    # 单位：最近一条非空
+    if "单位 (Unit)" in df.columns:
+        unit_vals = df["单位 (Unit)"].to_numpy(dtype=object, na_value=None)
+        unit_pos = _last_pos_per_item(pd.notna(unit_vals), starts, ends)
+        last_unit = np.array(
+            ["" if p < 0 or str(unit_vals[p]) == "nan" else str(unit_vals[p]) for p in unit_pos],
+            dtype=object,
         )
+    else:
+        last_unit = np.full(len(item_names), "", dtype=object)
 
-        rows.append({
-            "食材名称 (Item Name)": item,
-            "当前库存": float(cur_stock) if cur_stock is not None else np.nan,
-            "单位 (Unit)": last_unit,
-            "平均最近两周使用量": float(use14) if use14 is not None else np.nan,
-            "预计还能用天数": float(days_left) if days_left == days_left else np.nan,
-            "最近统计剩余日期": pd.to_datetime(last_rem_date, errors="coerce"),
-            "最近采购日期": pd.to_datetime(last_buy_date, errors="coerce"),
-            "最近采购数量": last_buy_qty,
-            "最近采购单价": last_buy_price,
-            "平均采购间隔(天)": avg_int,
-            "累计支出": total_spend_item,
-            "最近剩余数量": last_rem_qty,
-        })
-
-    out = pd.DataFrame(rows)
+    # 最近采购单价
+    if "单价 (Unit Price)" in df.columns:
+        price = df["单价 (Unit Price)"].to_numpy(dtype=np.float64, na_value=np.nan)
+    else:
+        price = np.full(len(df), np.nan)
+
+    # 累计支出：买入行的总价按物品码求和（空值不计）
+    spend = np.zeros(len(item_names))
+    if "总价 (Total Cost)" in df.columns:
+        total = df["总价 (Total Cost)"].to_numpy(dtype=np.float64, na_value=np.nan)
+        is_buy = (status == _ST_BUY) & ~np.isnan(total)
+        spend = np.bincount(item_codes[is_buy], weights=total[is_buy], minlength=len(item_names))
+
+    # 两条规则：每个物品是 [starts[i], ends[i]) 一段按 日期 + row_order 排好的行，共用同一组数组
+    n_items = len(item_names)
+    n_rem = np.bincount(item_codes[status == _ST_REM], minlength=n_items)
+    cur_arr, use_arr = _rules_by_item(starts, ends, n_rem, ticks, status, qty, day)
+
+    # 平均采购间隔：全表买入行（已按 物品码 + 日期 排好）一次做相邻差，只保留同一物品内的间隔，
+    # 按整天取整后再按物品码求平均；不足两次买入的物品为 NaN
+    buy_pos = np.flatnonzero(status == _ST_BUY)
+    gaps = np.diff(ticks[buy_pos]) // day
+    same_item = np.diff(item_codes[buy_pos]) == 0
+    gap_items = item_codes[buy_pos[1:]][same_item]
+    gap_sum = np.bincount(gap_items, weights=gaps[same_item], minlength=n_items)
+    gap_cnt = np.bincount(gap_items, minlength=n_items)
+    with np.errstate(invalid="ignore", divide="ignore"):
+        avg_arr = np.where(gap_cnt > 0, gap_sum / gap_cnt, np.nan)
+
+    # 还能用天数：循环结束后整列计算（用量 > 0 且当前库存可算才有值）
+    daily = use_arr / 14.0
+    with np.errstate(invalid="ignore", divide="ignore"):
+        days_arr = np.where((daily > 0) & ~np.isnan(cur_arr), cur_arr / daily, np.nan)
+
+    out = pd.DataFrame({
+        "食材名称 (Item Name)": item_names,
+        "当前库存": cur_arr,
+        "单位 (Unit)": last_unit,
+        "平均最近两周使用量": use_arr,
+        "预计还能用天数": days_arr,
+        "最近统计剩余日期": _take_at(dates, last_rem_pos, np.datetime64("NaT")),
+        "最近采购日期": _take_at(dates, last_buy_pos, np.datetime64("NaT")),
+        "最近采购数量": _take_at(qty, last_buy_pos, np.nan),
+        "最近采购单价": _take_at(price, last_buy_pos, np.nan),
+        "平均采购间隔(天)": avg_arr,
+        "累计支出": spend,
+        "最近剩余数量": _take_at(qty, last_rem_pos, np.nan),
+    })
 
     for c in ["最近统计剩余日期", "最近采购日期"]:
         if c in out.columns:
@@ -382,10 +491,12 @@ def compute_stats(df: pd.DataFrame) -> pd.DataFrame:
             )
 
     if not out.empty:
-        out = out.sort_values(
-            by=["预计还能用天数", "平均最近两周使用量"],
-            ascending=[True, False],
-            na_position="last"
-        ).reset_index(drop=True)
+        # 按 还能用天数 升序、两周用量 降序，空值都排最后；np.lexsort 稳定，等价于原 sort_values
+        days_nan, use_nan = np.isnan(days_arr), np.isnan(use_arr)
+        order = np.lexsort((
+            -np.where(use_nan, 0.0, use_arr), use_nan,
+            np.where(days_nan, 0.0, days_arr), days_nan,
+        ))
+        out = out.take(order).reset_index(drop=True)
 
     return out
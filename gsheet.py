@@ -58,6 +58,9 @@ EXPECTED_COLS = [
     "备注 (Notes)",
 ]
 
+# 二维写入（append_values_bulk）时每行的列顺序
+SHEET_COLS: Tuple[str, ...] = tuple(EXPECTED_COLS)
+
 
 # ======== 基础工具 ========
 def _get_creds():
@@ -220,11 +223,6 @@ def read_catalog() -> pd.DataFrame:
     return df
 
 
-@lru_cache(maxsize=1)
-def read_catalog_cached() -> pd.DataFrame:
-    return read_catalog()
-
-
 # ======== 规范化与行构造 ========
 def _norm_col(s: str) -> str:
     """
@@ -272,6 +270,16 @@ def _rows_from_records(records: List[Dict], header: List[str]) -> List[List]:
     return rows
 
 
+def _rows_from_values(values: List[List], header: List[str]) -> List[List]:
+    """
+    把按 SHEET_COLS 顺序排好的二维数组重排为“实际表头顺序”。
+    列映射只算一次，不再逐行构造 dict / 查 key。
+    """
+    pos = {_norm_col(k): i for i, k in enumerate(SHEET_COLS)}
+    idx = [pos.get(_norm_col(h)) for h in header]
+    return [[_clean_cell(row[i]) if i is not None else "" for i in idx] for row in values]
+
+
 # ======== 写入侧：指数退避重试 ========
 def _is_429(err: Exception) -> bool:
     """识别 429（配额/限流）。"""
@@ -335,15 +343,22 @@ def append_record(record: Dict) -> Tuple[int, dict]:
 
 def append_records_bulk(records: List[Dict]) -> dict:
     """
-    批量追加多行，显著降低写请求次数。
-    会对列名做规范化匹配，避免“只写进 Notes 列”的情况。
+    批量追加多行（dict 版）：按 SHEET_COLS 顺序转成二维数组后交给 append_values_bulk，
+    由它按实际表头重排列并写入。
+    """
+    return append_values_bulk([[r.get(k, "") for k in SHEET_COLS] for r in records])
+
+
+def append_values_bulk(values: List[List]) -> dict:
+    """
+    批量追加二维数组（每行按 SHEET_COLS 顺序），跳过 dict -> 行 的转换。
     """
-    if not records:
+    if not values:
         return {}
 
     ws = _get_ws()
     header = _header_cached()
-    rows = _rows_from_records(records, header)
+    rows = _rows_from_values(values, header)
 
     resp = _retry(lambda: ws.append_rows(
         rows,
@@ -384,12 +399,8 @@ def parse_updated_range_rows(resp: dict) -> Optional[Tuple[int, int]]:
     return None
 
 
-def tail_rows(n: int = 10) -> pd.DataFrame:
-    """
-    返回表尾最近 n 行（含表头）的快照，便于调试“写到哪里了”。
-    """
-    ws = _get_ws()
-    all_values = ws.get_all_values()  # 二维列表
+def _tail_from_values(all_values: List[List], n: int) -> pd.DataFrame:
+    """由 get_all_values() 的二维列表截取表尾 n 行（含表头），附带大致行号。"""
     if not all_values:
         return pd.DataFrame()
 
@@ -403,3 +414,18 @@ def tail_rows(n: int = 10) -> pd.DataFrame:
     # 附带显示大致行号（首行是 header，数据从第 2 行开始）
     df.insert(0, "__row__", list(range(1 + 1 + start, 1 + 1 + start + len(tail))))
     return df
+
+
+def batch_readback(last_n: int = 10) -> Tuple[pd.DataFrame, pd.DataFrame]:
+    """
+    写入后的回读：一次 values 请求同时得到「表尾快照」和「全表明细」，
+    代替“表尾快照 + read_records()”两次往返。返回 (tail_df, full_df)。
+    """
+    ws = _get_ws()
+    all_values = _retry(ws.get_all_values)  # 二维列表，首行是 header
+    if not all_values:
+        return pd.DataFrame(), pd.DataFrame()
+
+    tail = _tail_from_values(all_values, last_n)
+    full = pd.DataFrame(all_values[1:], columns=all_values[0])
+    return tail, full